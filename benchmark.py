@@ -0,0 +1,461 @@
+'''
+Offline benchmarks for the scanner station.
+
+    python benchmark.py                      # run all, save to bench_results/
+    python benchmark.py parse add_row        # run some
+    python benchmark.py --baseline bench_results/2026_01_05_101500.json
+
+Results are saved as JSON so releases can be compared against
+a baseline. Nothing needs a scanner or a PLC: serial ports are
+ptys (skipped where there is no pty support), the PLC is a local
+stand-in server and the gui runs on Qt's offscreen platform.
+'''
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import platform
+import argparse
+import statistics
+import socketserver
+import urllib.request
+import urllib.error
+import multiprocessing as mp
+from threading import Thread
+from datetime import datetime as dt
+
+try:
+    import pty
+    import tty
+except ImportError:
+    pty = None
+
+import serial
+
+import readScanner as scanner
+
+
+SCAN = b'DISC50600200000100910002101251041511207123051520715308154081550921MA949979-41904T          MA949979-41908G0000060N100 00315942025010600000000010160016'
+# save_to_file expects the reference number to end in the current year
+SCAN_TODAY = SCAN.decode('ASCII').replace('2025', dt.today().strftime('%Y'))
+
+INFEED = 'COM8'
+
+
+class NullPipe:
+    def send(self, data):
+        pass
+
+
+def measure(fn, number, repeat=5):
+    '''
+    Best and median seconds per call of fn over repeat runs
+    '''
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        runs.append((time.perf_counter() - start) / number)
+    return {'best': min(runs), 'median': statistics.median(runs), 'calls': number, 'repeat': repeat}
+
+
+# serial framing
+
+def pty_port():
+    '''
+    Pseudo terminal standing in for a USB-serial scanner,
+    raw mode so the line discipline does not rewrite CR/LF
+    '''
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    return master, slave, os.ttyname(slave)
+
+
+def feed_pty(fd, frames, chunk=4096):
+    data = b''.join(frames)
+    for i in range(0, len(data), chunk):
+        os.write(fd, data[i:i + chunk])
+
+
+def read_with_readline(ser, count):
+    # reader as it was before SerialFramer
+    received = 0
+    while received < count:
+        if ser.in_waiting > 0:
+            data = ser.readline().decode('utf-8').rstrip()
+            if data:
+                received += 1
+    return received
+
+
+def read_with_framer(ser, count, terminator):
+    framer = scanner.SerialFramer(terminator)
+    received = 0
+    while received < count:
+        chunk = ser.read(max(1, ser.in_waiting))
+        if chunk:
+            framer.feed(chunk)
+            for frame in framer.frames():
+                received += 1
+    return received
+
+
+def bench_serial(count=5000, terminator='CRLF'):
+    '''
+    Scans per second through a pty for readline() and SerialFramer
+    '''
+    if pty is None:
+        return {'skipped': 'no pty support'}
+
+    frames = [SCAN + scanner.TERMINATORS[terminator]] * count
+    results = {}
+    for name in ('readline', 'framer'):
+        master, slave, path = pty_port()
+        ser = serial.Serial(path, 9600, timeout=1)
+        writer = Thread(target=feed_pty, args=(master, frames))
+        writer.daemon = True
+        start = time.perf_counter()
+        writer.start()
+        if name == 'readline':
+            read_with_readline(ser, count)
+        else:
+            read_with_framer(ser, count, terminator)
+        elapsed = time.perf_counter() - start
+        writer.join()
+        ser.close()
+        os.close(master)
+        os.close(slave)
+        results[name] = {'scans': count, 'seconds': elapsed, 'scans_per_sec': count / elapsed}
+    return results
+
+
+# regex parse
+
+def bench_parse():
+    '''
+    process_data per scan, str and framed bytes
+    '''
+    pipe = NullPipe()
+    framed = memoryview(bytearray(SCAN_TODAY.encode('ASCII')))
+    return {
+        'str': measure(lambda: scanner.process_data(SCAN_TODAY, INFEED, pipe), 2000),
+        'frame': measure(lambda: scanner.process_data(framed, INFEED, pipe), 2000),
+    }
+
+
+# pipe transfer
+
+def pipe_sender(conn, count):
+    row = ['1904', '1T', '003159420', '060', INFEED]
+    for _ in range(count):
+        conn.send(row)
+    conn.close()
+
+
+def bench_pipe(count=20000):
+    '''
+    Scanner process to gui process, per message
+    '''
+    parent_conn, child_conn = mp.Pipe()
+    p = mp.Process(target=pipe_sender, args=(child_conn, count))
+    start = time.perf_counter()
+    p.start()
+    for _ in range(count):
+        parent_conn.recv()
+    elapsed = time.perf_counter() - start
+    p.join()
+    return {'messages': count, 'seconds': elapsed, 'per_message': elapsed / count}
+
+
+# gui table
+
+def gui_app():
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PySide6.QtWidgets import QApplication
+    return QApplication.instance() or QApplication(sys.argv)
+
+
+def table_app(**extra):
+    import scanDisplay
+    gui_app()
+    parent_conn, child_conn = mp.Pipe()
+    config = {'PLC_TCP_IP': '127.0.0.1', 'PLC_TCP_PORT': free_port(), 'INFEED': INFEED, 'OUTFEED': 'COM9'}
+    config.update(extra)
+    app = scanDisplay.TableApp(parent_conn, config)
+    app.scanner_conn = child_conn  # keep the scanner end open for read_from_pipe
+    return app
+
+
+def bench_add_row(sizes=(0, 100, 500, 1000, 2000), batch=100):
+    '''
+    Seconds per add_row for a new kanban against table size
+    '''
+    results = {}
+    for size in sizes:
+        app = table_app()
+        for i in range(size):
+            app.add_row(['1904', '1T', f'{i:09d}', '060', INFEED])
+        start = time.perf_counter()
+        for i in range(size, size + batch):
+            app.add_row(['1904', '1T', f'{i:09d}', '060', INFEED])
+        results[str(size)] = (time.perf_counter() - start) / batch
+        app.close()
+    return results
+
+
+# daily files
+
+def bench_export(sizes=(50, 200, 1000)):
+    '''
+    One save to a daily file already holding n rows, as each
+    press of Save does during a day
+    '''
+    header = ['Model', 'Packing code', 'Quantity']
+    today = dt.today().date()
+    kanban = {'date': today, 'lot': 'LOT1', 'order': '003159420', 'model': '1904', 'packing_code': '1T',
+              'qty_required': '060', 'good': '58', 'defect': '2', 'completed': '60', 'status': 'COMPLETED'}
+    results = {}
+    with tempfile.TemporaryDirectory() as dest_folders:
+        for size in sizes:
+            filename = f'kanban_{size}.xlsx'
+            scanner.create_excel([['003159420', '1904', '1T']] * size, header, dest_folders, filename)
+            start = time.perf_counter()
+            scanner.create_excel([['003159421', '1904', '1T']], header, dest_folders, filename)
+            results[str(size)] = {'xlsx': time.perf_counter() - start}
+
+            if scanner.pa is not None:
+                filename = f'kanban_{size}.parquet'
+                rows = [dict(kanban, order=f'{i:09d}') for i in range(size)]
+                scanner.create_parquet(rows, scanner.KANBAN_COLUMNS, dest_folders, filename, scanner.KANBAN_KEY)
+                start = time.perf_counter()
+                scanner.create_parquet([dict(kanban, order=f'{size:09d}')], scanner.KANBAN_COLUMNS, dest_folders, filename,
+                                       scanner.KANBAN_KEY)
+                results[str(size)]['parquet'] = time.perf_counter() - start
+    return results
+
+
+# status API load
+
+def status_poller(url, seconds, long_poll, interval):
+    '''
+    MES stand-in, conditional GET every interval seconds or
+    long-polls, runs in its own process
+    '''
+    etag = None
+    end = time.time() + seconds
+    while time.time() < end:
+        query = '?wait=5' if long_poll and etag else ''
+        headers = {'If-None-Match': etag} if etag else {}
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url + query, headers=headers)) as r:
+                etag = r.headers['ETag']
+                r.read()
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                raise
+        if not long_poll:
+            time.sleep(interval)
+
+
+def frame_times(app, seconds, interval=16):
+    '''
+    Lateness of a 16 ms Qt timer while a kanban is added every 50 ms
+    '''
+    from PySide6.QtCore import QEventLoop, QTimer, Qt
+    ticks = []
+    loop = QEventLoop()
+    tick = QTimer()
+    tick.setTimerType(Qt.PreciseTimer)
+    tick.timeout.connect(lambda: ticks.append(time.perf_counter()))
+    change = QTimer()
+    change.timeout.connect(lambda: app.add_row(['1904', '1T', f'{app.table.rowCount():09d}', '060', INFEED]))
+    tick.start(interval)
+    change.start(50)
+    QTimer.singleShot(int(seconds * 1000), loop.quit)
+    loop.exec()
+    tick.stop()
+    change.stop()
+
+    late = sorted((b - a) * 1000 - interval for a, b in zip(ticks, ticks[1:]))
+    return {
+        'frames': len(late),
+        'p50_ms': late[len(late) // 2],
+        'p99_ms': late[int(len(late) * 0.99)],
+        'max_ms': late[-1],
+    }
+
+
+def bench_status(pollers=20, seconds=3, rows=500, interval=0.1):
+    '''
+    Gui frame timing with and without MES pollers on the status API,
+    half of them long-poll, half send a conditional GET every interval
+    '''
+    port = free_port()
+    app = table_app(STATUS_API={'enabled': True, 'port': port})
+    for i in range(rows):
+        app.add_row(['1904', '1T', f'{i:09d}', '060', INFEED])
+    url = f'http://127.0.0.1:{port}/status'
+
+    idle = frame_times(app, seconds)
+    procs = [mp.Process(target=status_poller, args=(url, seconds + 1, i % 2 == 0, interval)) for i in range(pollers)]
+    for p in procs:
+        p.start()
+    time.sleep(0.5)
+    polled = frame_times(app, seconds)
+    for p in procs:
+        p.join()
+    app.close()
+    return {'idle': idle, 'polled': polled, 'pollers': pollers, 'interval': interval}
+
+
+# PLC round trip
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class PLCStandIn(socketserver.BaseRequestHandler):
+    '''
+    Answers every CRLF terminated request with a CRLF terminated
+    M101 reply until the client closes, see PLC_TERMINATOR
+    '''
+
+    def handle(self):
+        buf = b''
+        while True:
+            data = self.request.recv(4096)
+            if not data:
+                return
+            buf += data
+            *frames, buf = buf.split(b'\r\n')
+            self.request.sendall(b''.join(b'M101\r\n' for _ in frames))
+
+
+class PLCServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def plc_server():
+    server = PLCServer(('127.0.0.1', 0), PLCStandIn)
+    t = Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+
+def plc_exchange(host, port, messages):
+    '''
+    Run one PLCRequest to completion on a local event loop
+    '''
+    import scanDisplay
+    from PySide6.QtCore import QEventLoop
+    loop = QEventLoop()
+    request = scanDisplay.PLCRequest(host, port, messages)
+    request.finished.connect(loop.quit)
+    request.start()
+    loop.exec()
+
+
+def bench_plc(rows=50):
+    '''
+    Round trip per request and for starting a lot of rows
+    one request at a time versus one batch exchange
+    '''
+    gui_app()
+    server = plc_server()
+    host, port = server.server_address
+    try:
+        single = measure(lambda: plc_exchange(host, port, ['R101|003159420|060']), 200)
+
+        lot = [f'R101|{row:09d}|060' for row in range(rows)]
+        sequential = measure(lambda: [plc_exchange(host, port, [msg]) for msg in lot], 1)
+        batch = measure(lambda: plc_exchange(host, port, lot), 1)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {'single': single, 'lot_sequential': sequential, 'lot_batch': batch, 'rows': rows}
+
+
+BENCHMARKS = {
+    'serial': bench_serial,
+    'parse': bench_parse,
+    'pipe': bench_pipe,
+    'add_row': bench_add_row,
+    'export': bench_export,
+    'plc': bench_plc,
+    'status': bench_status,
+}
+
+
+def flatten(results, prefix=''):
+    # {'a': {'b': 1}} -> {'a.b': 1}, numbers only
+    out = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            out.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)):
+            out[f'{prefix}{key}'] = value
+    return out
+
+
+# sizes and counts, not timings
+COUNTS = ('calls', 'repeat', 'scans', 'messages', 'rows', 'frames', 'pollers', 'interval')
+
+
+def compare(results, baseline):
+    '''
+    Print timings next to the baseline, ratio > 1 is slower
+    '''
+    current = flatten(results['benchmarks'])
+    previous = flatten(baseline['benchmarks'])
+    for key in sorted(current):
+        if key not in previous or not previous[key] or not current[key] or key.endswith(COUNTS):
+            continue
+        if key.endswith('_per_sec'):
+            ratio = previous[key] / current[key]
+        else:
+            ratio = current[key] / previous[key]
+        flag = '  SLOWER' if ratio > 1.1 else ''
+        print(f'{key:<45} {previous[key]:>14.6f} {current[key]:>14.6f} {ratio:>7.2f}x{flag}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scanner station benchmarks')
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run, default all: {' '.join(BENCHMARKS)}")
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--output', default='bench_results', help='folder for results JSON')
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark {name}')
+
+    results = {
+        'date': dt.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'benchmarks': {},
+    }
+    for name in args.names or BENCHMARKS:
+        print(f'running {name} ...')
+        results['benchmarks'][name] = BENCHMARKS[name]()
+        print(json.dumps(results['benchmarks'][name], indent=2))
+
+    os.makedirs(args.output, exist_ok=True)
+    target = os.path.join(args.output, dt.now().strftime('%Y_%m_%d_%H%M%S') + '.json')
+    with open(target, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'saved {target}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
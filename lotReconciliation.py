@@ -0,0 +1,73 @@
+from collections import Counter
+
+
+class LotReconciliation:
+    '''
+    Infeed/outfeed bookkeeping for one lot, hashed by order no.
+    Every scan is O(1), the missing/extra lists are only built
+    when a report is asked for.
+    - missing: scanned at infeed, not (yet) at outfeed
+    - extra: scanned at outfeed, never at infeed
+    - duplicates: scanned more than once at the same feed
+    '''
+
+    def __init__(self, lot=''):
+        self.lot = lot
+        self.rows = {}  # order -> table row, infeed order
+        self.outfeed = set()  # orders seen at outfeed, matched or not
+        self.matched = 0
+        self.infeed_dups = Counter()
+        self.outfeed_dups = Counter()
+
+    def scan_infeed(self, order, row):
+        '''
+        True for a new kanban, False for a duplicate
+        '''
+        if order in self.rows:
+            self.infeed_dups[order] += 1
+            return False
+        self.rows[order] = row
+        return True
+
+    def scan_outfeed(self, order):
+        '''
+        'ok' for the first outfeed scan of an infeed kanban,
+        'duplicate' when scanned at outfeed before, 'extra'
+        when it never went through infeed
+        '''
+        if order in self.outfeed:
+            self.outfeed_dups[order] += 1
+            return 'duplicate'
+        self.outfeed.add(order)
+        if order not in self.rows:
+            return 'extra'
+        self.matched += 1
+        return 'ok'
+
+    def row(self, order):
+        return self.rows.get(order)
+
+    def infeed_count(self):
+        return len(self.rows)
+
+    def complete(self):
+        return self.matched == len(self.rows) > 0
+
+    def counts(self):
+        return {
+            'lot': self.lot,
+            'infeed': len(self.rows),
+            'outfeed': self.matched,
+            'missing': len(self.rows) - self.matched,
+            'extra': len(self.outfeed) - self.matched,
+            'duplicates': sum(self.infeed_dups.values()) + sum(self.outfeed_dups.values()),
+            'complete': self.complete(),
+        }
+
+    def report(self):
+        report = self.counts()
+        report['missing_orders'] = sorted(self.rows.keys() - self.outfeed)
+        report['extra_orders'] = sorted(self.outfeed - self.rows.keys())
+        report['infeed_duplicates'] = dict(self.infeed_dups)
+        report['outfeed_duplicates'] = dict(self.outfeed_dups)
+        return report
@@ -6,15 +6,26 @@ from datetime import datetime as dt
 from tabulate import tabulate
 import pandas as pd
 import json
+import signal
 import socket
 from queue import Queue
 from unittest.mock import patch
 
 import serial
 import time
+import glob
 from threading import Thread
 import logging
 
+from stationProfiler import RuntimeProfiler
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # parquet export is optional
+    pa = None
+
 
 def show_only_info(record):
     return record.levelname == "INFO"
@@ -44,6 +55,86 @@ logger.addHandler(file_handler)
 
 DEBUG = True
 
+# scanner frame terminators selectable per port in config.json
+TERMINATORS = {
+    'CR': b'\r',
+    'LF': b'\n',
+    'CRLF': b'\r\n',
+}
+WHITESPACE = b' \t\r\n'
+
+# reopen backoff for a lost or missing port, seconds. The cap bounds
+# how long a replugged scanner waits before it is picked up again
+RECONNECT_MIN = 0.05
+RECONNECT_MAX = 0.5
+SUPERVISE_INTERVAL = 1
+
+
+class SerialFramer:
+    '''
+    Split a raw serial byte stream into scans.
+    Chunks from bulk reads are appended to one reusable
+    buffer, complete frames are handed out as memoryview
+    slices of it (no copies) and the consumed bytes are
+    dropped once the slices have been released.
+    '''
+
+    def __init__(self, terminator='LF', max_frame=4096):
+        self.sep = TERMINATORS[terminator.upper()]
+        self.max_frame = max_frame
+        self.buf = bytearray()
+        self.pos = 0  # bytes already handed out, dropped on the next frames()
+
+    def feed(self, chunk):
+        self.buf += chunk
+
+    def reset(self):
+        self.buf.clear()
+        self.pos = 0
+
+    def frames(self):
+        '''
+        Yield every complete frame in the buffer, leading and trailing
+        whitespace trimmed. A yielded slice is only valid until the
+        next iteration, callers must not keep a reference to it.
+        Each frame is handed out once, also when the caller stops
+        iterating or raises halfway through.
+        '''
+        buf, sep = self.buf, self.sep
+        if self.pos:
+            # left over from an iteration that was not run to the end
+            del buf[:self.pos]
+            self.pos = 0
+        start = 0
+        with memoryview(buf) as view:
+            while True:
+                end = buf.find(sep, start)
+                if end < 0:
+                    break
+                first, last = start, end
+                while first < last and buf[first] in WHITESPACE:
+                    first += 1
+                while last > first and buf[last - 1] in WHITESPACE:
+                    last -= 1
+                start = end + len(sep)
+                self.pos = start  # consumed as soon as it is handed out
+                if first == last:
+                    continue  # empty frame, e.g. LF of a CRLF pair
+                frame = view[first:last]
+                try:
+                    yield frame
+                finally:
+                    frame.release()
+
+        self.pos = 0
+        if start:
+            del buf[:start]
+        elif len(buf) > self.max_frame:
+            # no terminator in sight, scanner misconfigured or line noise
+            logger.error(f'Dropping {len(buf)} bytes without terminator')
+            buf.clear()
+
+
 class MockScanReaderThread(Thread):
 
     def __init__(self, queue, _pipe):
@@ -51,11 +142,13 @@ class MockScanReaderThread(Thread):
         logger.debug('Starting thread for Mock serial ok')
         self.queue = queue
         self._pipe = _pipe
+        self.cpu_time = 0.0
         self.mock_data = 'DISC50600200000100910002101251041511207123051520715308154081550921MA949979-41904T          MA949979-41908G0000060N100 00315942025010600000000010160016'
 
     def run(self):
         while True:
             process_data(self.mock_data, self.queue, self._pipe)
+            self.cpu_time = time.thread_time()
             time.sleep(60)
 
 
@@ -68,15 +161,116 @@ class ScanReaderThread(Thread):
         self.config = config
         self.name = self.config.get('COM')
         logging.info('Listening at ' + self.config.get('COM'))
-        self.ser = serial.Serial(self.config.get('COM'), self.config.get('Baud'), timeout=self.config.get('timeout'))
+        self.ser = None  # opened in run, port may not be plugged in yet
+        self.framer = SerialFramer(self.config.get('terminator', 'LF'))
         self.queue = queue
         self._pipe = _pipe
+        self.cpu_time = 0.0  # read by RuntimeProfiler
+        self.lost_at = time.monotonic()
+        self.disconnects = 0
+
+    def port_present(self):
+        # device nodes come and go with hot-plug, no need to try opening
+        # a path that is not there. COM ports can only be tried
+        port = self.config.get('COM')
+        return not port.startswith('/') or os.path.exists(port)
+
+    def open_port(self):
+        '''
+        Open the port, retrying with bounded backoff until it is there
+        '''
+        delay = RECONNECT_MIN
+        attempts = 0
+        while self.ser is None:
+            attempts += 1
+            if self.port_present():
+                try:
+                    self.ser = serial.Serial(self.config.get('COM'), self.config.get('Baud'), timeout=self.config.get('timeout'))
+                    break
+                except (serial.SerialException, OSError) as e:
+                    if attempts == 1:
+                        logger.error(f'Cannot open {self.name}: {e}, retrying')
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX)
+
+        recovery = time.monotonic() - self.lost_at
+        logger.info(f'METRIC port_open port={self.name} seconds={recovery:.3f} attempts={attempts} disconnects={self.disconnects}')
+        self.framer.reset()  # partial frame from before the loss is garbage
+
+    def close_port(self):
+        try:
+            self.ser.close()
+        except Exception:
+            pass
+        self.ser = None
+        self.lost_at = time.monotonic()
+        self.disconnects += 1
+
+    def run(self):
+        try:
+            while True:
+                if self.ser is None:
+                    self.open_port()
+                try:
+                    # blocks up to timeout for the first byte, then takes
+                    # everything already buffered by the driver in one go
+                    chunk = self.ser.read(max(1, self.ser.in_waiting))
+                except (serial.SerialException, OSError):
+                    logger.error(f'Lost {self.name}', exc_info=True)
+                    self.close_port()
+                    continue
+
+                if chunk:
+                    self.framer.feed(chunk)
+                    for frame in self.framer.frames():  # barcode
+                        try:
+                            process_data(frame, self.name, self._pipe)
+                        except Exception:
+                            # one bad scan must not take the port down
+                            logger.error(f'Cannot process scan from {self.name}: {bytes(frame)}', exc_info=True)
+                self.cpu_time = time.thread_time()
+        finally:
+            # release the port so the supervisor's replacement can open it
+            if self.ser is not None:
+                self.close_port()
+
+
+class PortSupervisor(Thread):
+    '''
+    Keeps one reader thread per configured port alive. Readers
+    recover from unplugged ports themselves, a reader that dies
+    on anything else is replaced here.
+    '''
+
+    def __init__(self, com_info, queue, _pipe, debug=False):
+        Thread.__init__(self)
+        self.daemon = True
+        self.com_info = com_info
+        self.queue = queue
+        self._pipe = _pipe
+        self.debug = debug
+        self.threads = [self.create(conf) for conf in com_info]
+
+    def create(self, conf):
+        logger.info(conf)
+        if self.debug:
+            t = MockScanReaderThread(self.queue, self._pipe)
+        else:
+            t = ScanReaderThread(conf, self.queue, self._pipe)
+        t.daemon = True
+        t.start()
+        return t
 
     def run(self):
         while True:
-            if self.ser.in_waiting > 0:
-                data = self.ser.readline().decode('utf-8').rstrip()  # barcode
-                process_data(data, self.name, self._pipe)
+            time.sleep(SUPERVISE_INTERVAL)
+            for i, t in enumerate(self.threads):
+                if not t.is_alive():
+                    logger.error(f'Reader thread {t.name} died, restarting')
+                    try:
+                        self.threads[i] = self.create(self.com_info[i])
+                    except Exception:
+                        logger.error("Scanner thread creation failed", exc_info=True)
 
 
 class PLCSenderThread(Thread):
@@ -148,6 +342,92 @@ def create_excel(data, data_header, dest_folders, filename):
     df.to_excel(target_file, index=False)
 
 
+# columnar export schemas, column name and pyarrow type
+# keep these stable, months of files are read back together
+KANBAN_COLUMNS = [
+    ('date', 'date32'),
+    ('lot', 'string'),
+    ('order', 'string'),
+    ('model', 'string'),
+    ('packing_code', 'string'),
+    ('qty_required', 'int32'),
+    ('good', 'int32'),
+    ('defect', 'int32'),
+    ('completed', 'int32'),
+    ('status', 'string'),
+]
+
+LOT_COLUMNS = [
+    ('date', 'date32'),
+    ('lot', 'string'),
+    ('kanbans', 'int32'),
+]
+
+# a row saved again replaces the stored one with the same key
+KANBAN_KEY = ('date', 'lot', 'order')
+LOT_KEY = ('date', 'lot')
+
+
+def arrow_schema(columns):
+    return pa.schema([(name, getattr(pa, type_name)()) for name, type_name in columns])
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def create_parquet(data, columns, dest_folders, filename, key=(), compression='zstd'):
+    '''
+    Add rows (dicts keyed by column name) to the day's parquet
+    file, typed and compressed per columns. Rows whose key
+    columns match a stored row replace it, so saving the
+    table again does not count a kanban twice
+    '''
+    if pa is None:
+        logger.error('pyarrow is not installed, skipping parquet export')
+        return
+
+    schema = arrow_schema(columns)
+    for row in data:
+        for name, type_name in columns:
+            if type_name.startswith('int'):
+                row[name] = to_int(row.get(name))
+
+    if key:
+        data = list({tuple(row.get(k) for k in key): row for row in data}.values())
+
+    target_file = os.path.join(dest_folders, filename)
+    table = pa.Table.from_pylist(data, schema=schema)
+    if os.path.exists(target_file):
+        stored = pq.read_table(target_file, schema=schema)
+        if key:
+            saved = {tuple(row.get(k) for k in key) for row in data}
+            stored = pa.Table.from_pylist([row for row in stored.to_pylist()
+                                           if tuple(row[k] for k in key) not in saved], schema=schema)
+        table = pa.concat_tables([stored, table])
+
+    # write aside and swap so a crash never leaves half a file
+    tmp_file = target_file + '.tmp'
+    pq.write_table(table, tmp_file, compression=compression)
+    os.replace(tmp_file, target_file)
+
+
+def load_parquet(filename, columns=None, root=None):
+    '''
+    Read every day's file as one DataFrame, e.g.
+    load_parquet('MRE_QR_kanban_info.parquet', ['date', 'model', 'good'])
+    '''
+    if pa is None:
+        logger.error('pyarrow is not installed, cannot read parquet export')
+        return None
+
+    files = sorted(glob.glob(os.path.join(root or os.getcwd(), '*', filename)))
+    return ds.dataset(files, format='parquet').to_table(columns=columns).to_pandas()
+
+
 def save_to_file(prefix, input_val, name, _pipe):
 
     scan = re.findall(r"MA.*", input_val)[0]
@@ -200,16 +480,27 @@ def save_to_file(prefix, input_val, name, _pipe):
     create_excel(data, data_header, dest_folders, 'MRE_QR_kanban_info.xlsx')'''
     
 
-def save_to_disk(lot_number, dest_folders):
+def save_to_disk(lot_number, dest_folders, formats=('xlsx',), kanbans=None):
     data = []
     data_header = ['Lot no.']
     data.append(lot_number)
 
     create_dir(dest_folders)
-    create_excel(data, data_header, dest_folders, 'lot_numbers.xlsx')
+    if 'xlsx' in formats:
+        create_excel(data, data_header, dest_folders, 'lot_numbers.xlsx')
+    if 'parquet' in formats:
+        row = {'date': dt.today().date(), 'lot': lot_number, 'kanbans': kanbans}
+        create_parquet([row], LOT_COLUMNS, dest_folders, 'lot_numbers.parquet', LOT_KEY)
 
 
-def process_data(data : str, name, _pipe):
+def process_data(data, name, _pipe):
+    if not isinstance(data, str):
+        # frame slice from SerialFramer, decode only scans we handle
+        if data[:4] != b'DISC' and data[:2] != b'MA':
+            logger.debug(f'Ignoring frame from {name}: {bytes(data)}')
+            return
+        data = str(data, 'utf-8', errors='replace')
+
     if data.startswith('DISC'):
         save_to_file('DISC', data, name, _pipe)
     elif data.startswith('MA'):
@@ -224,17 +515,18 @@ def process_with_threads(conf : json, _pipe):
     queue = Queue()
 
     try:
-        for i in range(len(com_info)):
-            logger.info(com_info[i])
-            if DEBUG:
-                t = MockScanReaderThread(queue, _pipe)
-            else:    
-                t = ScanReaderThread(com_info[i], queue, _pipe)
-            t.daemon = True
-            t.start()
+        supervisor = PortSupervisor(com_info, queue, _pipe, DEBUG)
+        supervisor.start()
+        threads = supervisor.threads
     except Exception as e:
+        threads = []
         logger.error("Scanner thread creation failed", exc_info=True)
 
+    # profiling on demand: SIGUSR1 where available, or ['PROFILE', seconds] from the gui
+    profiler = RuntimeProfiler.from_config('scanner', conf)
+    if profiler.enabled and hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.sample(threads=threads))
+
     # tcp = TCPClient(conf.get('PLC_TCP_IP'), conf.get('PLC_TCP_PORT'))
     # try:
     #     t = PLCSenderThread(queue, tcp)
@@ -246,7 +538,10 @@ def process_with_threads(conf : json, _pipe):
     while True:
         try:
             logger.debug("Health check OK")
-            time.sleep(60)
+            if _pipe.poll(60):
+                msg = _pipe.recv()
+                if msg and msg[0] == 'PROFILE' and profiler.enabled:
+                    profiler.sample(msg[1], threads)
         except KeyboardInterrupt as e:
             print("shutting down ...")
             break
@@ -1,24 +1,30 @@
 import sys
 import os
-import time
 import json
 import base64
+import signal
+import socket
 import multiprocessing as mp
 import logging
 from threading import Thread
+from functools import partial
 from datetime import datetime as dt
-import socket
 from queue import Queue
 from queue import Queue
 
 
 from PySide6.QtWidgets import (QMainWindow, QApplication, QWidget, QVBoxLayout, QHBoxLayout,
-                               QLineEdit, QPushButton, QTableWidget, QTableWidgetItem, QHeaderView, QLabel, QDateEdit)
-from PySide6.QtCore import  QObject, Signal, Slot, QByteArray, QRunnable, QThreadPool, QTimer, Qt
-from PySide6.QtGui import QPixmap, QColor, QBrush
+                               QLineEdit, QPushButton, QTableWidget, QTableWidgetItem, QHeaderView, QLabel, QDateEdit, QMessageBox)
+from PySide6.QtCore import  QObject, Signal, Slot, QByteArray, QTimer, QSocketNotifier, Qt
+from PySide6.QtNetwork import QTcpSocket
+from PySide6.QtGui import QPixmap, QColor, QBrush, QKeySequence, QShortcut
 
 
 import readScanner as scanner
+from stationProfiler import RuntimeProfiler
+from shiftAnalytics import ShiftAnalytics
+from statusServer import StatusServer
+from lotReconciliation import LotReconciliation
 
 
 # create logger
@@ -48,18 +54,114 @@ class CustomLineEdit(QLineEdit):
         self.text_set.emit(text)
 
 
+# PLC wire format, the same for every request and reply:
+# ASCII messages 'Rxxx|field|...' each terminated by CRLF. The
+# PLC answers every request with exactly one CRLF terminated
+# 'Mxxx|...' reply, in request order, and keeps the connection
+# open until the client closes it, so one or many requests may
+# share a connection
+PLC_TERMINATOR = 'CRLF'
+PLC_FRAME_SEP = scanner.TERMINATORS[PLC_TERMINATOR]
+PLC_TIMEOUT_MS = 3000  # connect + reply, per exchange
+PLC_POLL_MS = 5000
+STATUS_PUBLISH_MS = 200
+REPORT_LIMIT = 50  # order numbers listed per category in the lot report
+
+
 class TcpSignals(QObject):
     result = Signal(tuple)
-    fail = Signal(tuple)
     conn = Signal(int)
 
 
 class Communicator(QObject):
     data_received = Signal(list)
 
-class TCPWorker(QRunnable):
+
+class PLCRequest(QObject):
     '''
-    Worker thread
+    One exchange with the PLC on the Qt event loop: connect,
+    write the messages PLC_FRAME_SEP terminated, collect one
+    reply per message on readyRead and close. No messages
+    only checks that the PLC accepts connections.
+    '''
+    finished = Signal(list, bool)  # replies, connected
+
+    def __init__(self, host, port, messages=(), timeout=PLC_TIMEOUT_MS, parent=None):
+        super().__init__(parent)
+        self.host = host
+        self.port = port
+        self.payload = b''.join(msg.encode('ASCII') + PLC_FRAME_SEP for msg in messages)
+        self.expected = len(messages)
+        self.replies = []
+        self.connected = False
+        self.done = False
+        self.framer = scanner.SerialFramer(PLC_TERMINATOR)
+
+        self.socket = QTcpSocket(self)
+        self.socket.connected.connect(self.on_connected)
+        self.socket.readyRead.connect(self.on_ready_read)
+        self.socket.errorOccurred.connect(self.on_error)
+        self.socket.disconnected.connect(self.finish)
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(timeout)
+        self.timer.timeout.connect(self.on_timeout)
+
+    def start(self):
+        self.timer.start()
+        self.socket.connectToHost(self.host, self.port)
+
+    def on_connected(self):
+        self.connected = True
+        if not self.payload:
+            self.finish()
+            return
+        logger.info(f'Sending {self.payload} to plc')
+        self.socket.write(self.payload)
+
+    def on_ready_read(self):
+        self.framer.feed(self.socket.readAll().data())
+        for frame in self.framer.frames():
+            self.replies.append(str(frame, 'ASCII'))
+        if len(self.replies) >= self.expected:
+            self.finish()
+
+    def on_error(self, error):
+        if not self.done:
+            logger.error(f'PLC socket error: {self.socket.errorString()}')
+            self.finish()
+
+    def on_timeout(self):
+        logger.error(f'PLC timeout, {len(self.replies)} of {self.expected} replies')
+        self.finish()
+
+    def finish(self):
+        if self.done:
+            return
+        self.done = True
+        self.timer.stop()
+        self.socket.abort()
+        self.finished.emit(self.replies, self.connected)
+        self.deleteLater()
+
+    def abort(self):
+        '''
+        Drop the exchange without reporting it
+        '''
+        self.done = True
+        self.timer.stop()
+        self.socket.abort()
+        self.deleteLater()
+
+
+class PLCLink(QObject):
+    '''
+    Polls the PLC for the row in process, R101 quantity then
+    R102-R104 good/defect/completed, one exchange every
+    PLC_POLL_MS. Runs on the Qt event loop, stop() is immediate.
+    Rows in acked already had their R101 answered (e.g. by a
+    batch), polling starts them at R102.
     '''
 
     def __init__(self, table, ip, port, row, col):
@@ -71,68 +173,27 @@ class TCPWorker(QRunnable):
         self.active = False
         self.row = row
         self.col = col
-        self.running = True
-
-    """def __init__(self, qty : int, host, port, row):
-        super().__init__()
-        self.data = qty
-        self.host = host
-        self.port = port
-        self.signal = TcpSignals()
-        self.recv_bytes = 4096
-        self.row = row
-
-    @Slot()  # QtCore.Slot
-    def run(self):
+        self.running = False
+        self.request = None  # exchange in flight
+        self.acked = set()  # rows whose quantity the PLC has confirmed (M101)
 
-        logger.info(f'Sending to PLC --- {dt.now()}')
-        success = True
-        retry  = 1
-        while retry > 0:
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.connect((self.host, self.port))
-                    logger.info(f'Sending  {self.data} to plc')
-                    s.sendall(self.data.to_bytes(2, 'big'))
-                    resp = s.recv(self.recv_bytes)
-                    logger.info(f'Reply from TCP server: {resp}')
-                    success = True
-                    retry = 0
-            except ConnectionRefusedError:
-                logger.error("TCP connection refused", exc_info=True)
-                self.signal.conn.emit(0)
-                time.sleep(1)
-                success = False
-                retry -= 1
-            except AttributeError:
-                logger.error(f'Data is not int : {self.data}', exc_info=True)
-                time.sleep(1)
-                retry = -1
-                success = False
-
-        # emit signal to change PLC success status
-        # if it got here then resp is received
-        # so emit signal for PLC tcp status as well again
-        if success:
-            self.signal.conn.emit(1)
-            result = int.from_bytes(resp, 'big')
-            if result:
-                self.signal.result.emit((result, self.row))
-            else:
-                self.signal.fail.emit((result, self.row))"""
+        self.timer = QTimer(self)
+        self.timer.setInterval(PLC_POLL_MS)
+        self.timer.timeout.connect(self.start_plc_comm)
 
-    @Slot()
-    def run(self):
+    def start(self):
         self.active = True
-        while self.running:
-            self.start_plc_comm()
-            time.sleep(5)
-
+        self.running = True
+        self.timer.start()
+        self.start_plc_comm()
 
     def start_plc_comm(self):
         num_rows = self.table.rowCount()
 
-        if self.col < 7 and self.row < num_rows:
+        if self.col == 3 and self.row in self.acked:
+            self.col = 4
+
+        if self.request is None and self.col < 7 and self.row < num_rows:
             order_no = self.table.item(self.row, 0).text()
             req_qty = self.table.item(self.row, self.col).text()
             if self.col == 3:
@@ -143,7 +204,6 @@ class TCPWorker(QRunnable):
                 self.create_req_defect_msg(order_no)
             elif self.col == 6:
                 self.create_req_completed_msg(order_no)
-        
 
     def create_req_qty_msg(self, order_no : str, req_qty : str):
         data = '|'.join(['R101', order_no, req_qty])
@@ -163,50 +223,25 @@ class TCPWorker(QRunnable):
 
     def send_tcp(self, payload : str):
         logger.info(f'Sending to PLC --- {dt.now()}')
-        data = payload.encode('ASCII')
-        success = True
-        retry  = 2
-        while retry > 0:
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.connect((self.host, self.port))
-                    logger.info(f'Sending {data} to plc')
-                    # s.sendall(self.data.to_bytes(2, 'big'))
-
-                    s.sendall(data)
-                    resp = s.recv(4096)
-                    if resp:
-                        logger.info(f'Reply from TCP server: {resp}')
-                        success = True
-                        retry = 0
-                    else:
-                        logger.info(f'No response from plc')
-
-            except ConnectionRefusedError:
-                logger.error("TCP connection refused", exc_info=True)
-                self.signal.conn.emit(0)
-                time.sleep(1)
-                success = False
-                retry -= 1
-            except AttributeError:
-                logger.error(f'Data is not int : {data}', exc_info=True)
-                time.sleep(1)
-                retry = -1
-                success = False
-            except socket.timeout:
-                logger.error("Timeout", exc_info=True)
-                time.sleep(2)
-
-        if success:
-            self.signal.conn.emit(1)
-            #result = int.from_bytes(resp, 'big')
-            result = resp.decode('ASCII')
-            if resp:
-                self.signal.result.emit((result, self.row, self.col))
-                self.col += 1
-            else:
-                self.signal.fail.emit((result, self.row))
-    
+        self.request = PLCRequest(self.host, self.port, [payload], parent=self)
+        self.request.finished.connect(partial(self.on_reply, self.row, self.col))
+        self.request.start()
+
+    def on_reply(self, row, col, replies, connected):
+        self.request = None
+        self.signal.conn.emit(1 if connected else 0)
+        if not replies:
+            logger.info('No response from plc')
+            return
+
+        logger.info(f'Reply from TCP server: {replies[0]}')
+        # move on before emitting, the result handler may reassign the row
+        if (row, col) == (self.row, self.col):
+            self.col += 1
+        self.signal.result.emit((replies[0], row, col))
+
+    def acknowledge(self, row):
+        self.acked.add(row)
 
     def reassign(self, row, col):
         self.col = col
@@ -217,6 +252,54 @@ class TCPWorker(QRunnable):
 
     def stop(self):
         self.running = False
+        self.timer.stop()
+        if self.request is not None:
+            self.request.abort()
+            self.request = None
+
+
+class AnalyticsPanel(QWidget):
+    '''
+    One line of live shift figures from ShiftAnalytics
+    '''
+
+    def __init__(self, analytics, parent=None):
+        super().__init__(parent)
+        self.analytics = analytics
+
+        layout = QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.fields = {}
+        for key, title in [('kanbans_per_hour', 'Kanbans/h'), ('scans_per_hour', 'Scans/h'),
+                           ('good', 'Good'), ('defect', 'Defect'), ('defect_rate', 'Defect %'),
+                           ('avg_cycle', 'Avg cycle'), ('last_cycle', 'Last cycle')]:
+            field = QLineEdit('-')
+            field.setReadOnly(True)
+            field.setFixedWidth(80)
+            layout.addWidget(QLabel(title))
+            layout.addWidget(field)
+            self.fields[key] = field
+        layout.addStretch()
+        self.setLayout(layout)
+
+        # rolling window figures decay without events too
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(10000)
+
+    def refresh(self):
+        summary = self.analytics.summary()
+        for key in ('kanbans_per_hour', 'scans_per_hour'):
+            self.fields[key].setText(f'{summary[key]:.1f}')
+        for key in ('good', 'defect'):
+            self.fields[key].setText(str(summary[key]))
+        self.fields['defect_rate'].setText(f"{summary['defect_rate'] * 100:.1f}")
+        for key in ('avg_cycle', 'last_cycle'):
+            value = summary[key]
+            self.fields[key].setText('-' if value is None else f'{value / 60:.1f} min')
+
+        self.setToolTip('\n'.join(f"{model}: good {m['good']}, defect {m['defect']} ({m['defect_rate'] * 100:.1f}%)"
+                                   for model, m in summary['models'].items()))
 
 
 class TableApp(QWidget):
@@ -234,8 +317,11 @@ class TableApp(QWidget):
         self.tcp_port = config.get('PLC_TCP_PORT')
         self.scanner_infeed = config.get('INFEED')
         self.scanner_outfeed = config.get('OUTFEED')
+        self.export_formats = config.get('EXPORT_FORMATS', ['xlsx'])
         self.travel_sheet = ''
         self.next = 0  # track which row in process
+        self.analytics = ShiftAnalytics(config.get('ANALYTICS_WINDOW', 3600), config.get('SHIFT_STARTS', ['00:00']))
+        self.reconciliation = LotReconciliation()
 
         self.initUI()
         logger.info("Setting up Signal...")
@@ -246,16 +332,125 @@ class TableApp(QWidget):
         self.t.daemon = True
         self.t.start()
         self.queue = Queue()
-        self.threadpool = QThreadPool()
-        self.worker = TCPWorker(self.table, self.tcp_ip, self.tcp_port, 0, 3)
+        self.worker = PLCLink(self.table, self.tcp_ip, self.tcp_port, 0, 3)
+
+        # hidden profiling trigger: Ctrl+Shift+P or SIGUSR1
+        self.profiler = RuntimeProfiler.from_config('gui', config)
+        if self.profiler.enabled:
+            self.profile_shortcut = QShortcut(QKeySequence('Ctrl+Shift+P'), self)
+            self.profile_shortcut.activated.connect(self.start_profiling)
+            if hasattr(signal, 'SIGUSR1'):
+                # Python only runs signal handlers while the main thread runs Python
+                # code, the wakeup fd makes the idle Qt loop call into Python
+                self.signal_rsock, self.signal_wsock = socket.socketpair()
+                self.signal_wsock.setblocking(False)
+                signal.set_wakeup_fd(self.signal_wsock.fileno())
+                self.signal_notifier = QSocketNotifier(self.signal_rsock.fileno(), QSocketNotifier.Read, self)
+                self.signal_notifier.activated.connect(lambda: self.signal_rsock.recv(64))
+                # defer to the loop, the handler interrupts whatever the main thread was doing
+                signal.signal(signal.SIGUSR1, lambda *_: QTimer.singleShot(0, self.start_profiling))
+
+        # status API for MES polling, snapshot rebuilt at most every STATUS_PUBLISH_MS
+        try:
+            self.status_server = StatusServer.from_config(config)
+        except OSError:
+            # port taken or address invalid, the station runs without the API
+            logger.error('Status API could not start', exc_info=True)
+            self.status_server = None
+        if self.status_server is not None:
+            self.status_timer = QTimer(self)
+            self.status_timer.setSingleShot(True)
+            self.status_timer.setInterval(STATUS_PUBLISH_MS)
+            self.status_timer.timeout.connect(self.publish_status)
+
+            # rows stay encoded until the table reports them changed
+            self.status_rows = []
+            model = self.table.model()
+            model.rowsInserted.connect(self.status_rows_inserted)
+            model.rowsRemoved.connect(self.status_rows_removed)
+            model.modelReset.connect(self.status_rows_reset)
+            model.dataChanged.connect(self.status_rows_changed)
+            for changed in (self.name_field.textChanged, self.infeed_field.textChanged,
+                            self.outfeed_field.textChanged, self.plc_tcp_status_text.textChanged):
+                changed.connect(self.status_changed)
+
+            self.publish_status()
+            self.status_server.start()
 
 
     def closeEvent(self, event):
         self.worker.stop()
-        self.threadpool.waitForDone()
+        if self.status_server is not None:
+            self.status_server.stop()
         super().closeEvent(event)
 
 
+    def status_changed(self, *args):
+        if not self.status_timer.isActive():
+            self.status_timer.start()
+
+
+    def status_rows_inserted(self, parent, first, last):
+        self.status_rows[first:first] = [None] * (last - first + 1)
+        self.status_changed()
+
+
+    def status_rows_removed(self, parent, first, last):
+        del self.status_rows[first:last + 1]
+        self.status_changed()
+
+
+    def status_rows_reset(self):
+        self.status_rows = [None] * self.table.rowCount()
+        self.status_changed()
+
+
+    def status_rows_changed(self, top_left, bottom_right, roles=()):
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            self.status_rows[row] = None
+        self.status_changed()
+
+
+    def publish_status(self):
+        '''
+        Hand the status API a fresh snapshot of lot, rows and PLC link,
+        only rows changed since the last one are read from the table
+        '''
+        names = [name for name, _ in scanner.KANBAN_COLUMNS[2:]]
+        for row, encoded in enumerate(self.status_rows):
+            if encoded is None:
+                items = (self.table.item(row, col) for col in range(len(names)))
+                values = {name: item.text() if item else '' for name, item in zip(names, items)}
+                self.status_rows[row] = json.dumps(values, sort_keys=True).encode('utf-8')
+
+        self.status_server.publish({
+            'lot': self.name_field.text(),
+            'infeed': self.infeed,
+            'outfeed': self.outfeed,
+            'infeed_status': self.infeed_field.text(),
+            'plc_link': self.plc_tcp_status_text.text(),
+            'plc_row': self.worker.row if self.worker.running else None,
+            'reconciliation': self.reconciliation.counts(),
+            'analytics': self.analytics.summary(),
+        }, self.status_rows)
+
+
+    def start_profiling(self):
+        '''
+        Profile gui and scanner process for the configured duration,
+        cProfile covers the Qt thread (PLC link included), sampling
+        covers all threads
+        '''
+        duration = self.profiler.duration
+        if not self.profiler.sample(duration):
+            return
+
+        logger.info(f"Profiling for {duration}s")
+        self.profiler.profile_begin()
+        QTimer.singleShot(int(duration * 1000), self.profiler.profile_end)
+        self.pipe.send(['PROFILE', duration])
+
+
     def initUI(self):
         self.setWindowTitle('Barcode Scanner Reader Display')
         self.setGeometry(100, 100, 5000, 800)
@@ -324,9 +519,21 @@ class TableApp(QWidget):
         self.set_infeed_btn = QPushButton('Set infeed', self)
         self.set_infeed_btn.clicked.connect(self.set_in_status)
 
+        self.outfeed_label = QLabel("Outfeed")
+        self.outfeed_field = QLineEdit(self)
+        self.outfeed_field.setPlaceholderText('Idle')
+        self.outfeed_field.setStyleSheet("background-color: lightgrey;color:white")
+        self.outfeed_field.setReadOnly(True)
+
+        self.report_btn = QPushButton('Report', self)
+        self.report_btn.clicked.connect(self.show_reconciliation)
+
         feed_status_layout.addWidget(self.infeed_label)
         feed_status_layout.addWidget(self.infeed_field)
         feed_status_layout.addWidget(self.set_infeed_btn)
+        feed_status_layout.addWidget(self.outfeed_label)
+        feed_status_layout.addWidget(self.outfeed_field)
+        feed_status_layout.addWidget(self.report_btn)
 
         # Table
         self.table = QTableWidget(self)
@@ -345,6 +552,11 @@ class TableApp(QWidget):
         layout.addLayout(plc_layout)
         layout.addLayout(input_layout)
         layout.addLayout(feed_status_layout)
+        self.analytics_panel = AnalyticsPanel(self.analytics, self)
+        layout.addWidget(self.analytics_panel)
+        self.shift_timer = QTimer(self)
+        self.shift_timer.timeout.connect(self.check_shift)
+        self.shift_timer.start(10000)
         layout.addWidget(self.table)
         layout.addWidget(self.save_table_btn)
         layout.addWidget(self.clear_button)
@@ -362,17 +574,17 @@ class TableApp(QWidget):
             logger.info(f"Rec: {travel_sheet_num}")
             if travel_sheet_num != self.travel_sheet:  # new travel sheet
                 self.travel_sheet = travel_sheet_num  # update travel sheet number
+                self.reconciliation.lot = travel_sheet_num
                 if not self.worker.is_active():
                     logger.info("Starting PLC thread...")
                     # running for first time
                     self.worker.signal.result.connect(self.get_plc_status)
-                    self.worker.signal.fail.connect(self.get_plc_status)
                     self.worker.signal.conn.connect(self.toggle_tcp_conn)
-                    self.threadpool.start(self.worker)
+                    self.worker.start()
                     self.set_col_text(0, 7, 'RUNNING')
                     self.color_row(0, QColor(235, 169, 158))
                 elif not self.worker.running:
-                    self.worker.running = True
+                    self.worker.start()
 
 
     def reset_style(self, widget, text):
@@ -381,18 +593,19 @@ class TableApp(QWidget):
 
 
     def check_tcp_status(self):
+        probe = PLCRequest(self.tcp_ip, self.tcp_port, parent=self)
+        probe.finished.connect(self.show_tcp_status)
+        probe.start()
 
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((self.tcp_ip, self.tcp_port))
-                logger.info(s.getpeername())
-                self.plc_tcp_status_text.setText('CONNECTED')
-                self.plc_tcp_status_text.setStyleSheet("background-color: green;color:white")
 
-        except ConnectionRefusedError:
+    def show_tcp_status(self, replies, connected):
+        if connected:
+            self.plc_tcp_status_text.setText('CONNECTED')
+            self.plc_tcp_status_text.setStyleSheet("background-color: green;color:white")
+        else:
             self.plc_tcp_status_text.setText('FAILED')
             self.plc_tcp_status_text.setStyleSheet("background-color: red;color:white")
-            logger.error("TCP connection refused", exc_info=True)
+            logger.error("TCP connection failed")
 
 
     def toggle_tcp_conn(self, status):
@@ -408,7 +621,7 @@ class TableApp(QWidget):
         threads to get value from scanned QR
         """
         while True:
-            if self.pipe.poll():
+            if self.pipe.poll(1):
                 data = self.pipe.recv()
                 logger.info(data)
                 self.communicator.data_received.emit(data)
@@ -420,29 +633,58 @@ class TableApp(QWidget):
         '''
 
         if not self.infeed:  # if outfeed is false it means
+            rows = []
             for row in range(self.table.rowCount()):
-                if self.table.item(row, 6).text()  == 'COMPLETED':
+                if self.table.item(row, 7).text()  == 'COMPLETED' or row in self.worker.acked:
                     continue
 
+                order_no = self.table.item(row, 0).text()
                 qty = self.table.item(row, 3).text()
-                self.send_tcp(row, qty)
+                rows.append((row, order_no, qty))
+
+            self.send_batch(rows)
 
 
     def send_tcp(self, row, data):
         '''
         Func to transfer to PLC
         '''
-        try:
-            worker = TCPWorker(int(data), self.tcp_ip, self.tcp_port, row)
-            worker.signal.result.connect(self.get_plc_status)
-            worker.signal.fail.connect(self.get_plc_status)
-            worker.signal.conn.connect(self.toggle_tcp_conn)
-            self.threadpool.start(worker)
-            self.set_col_text(row, 6, 'RUNNING')
+        self.send_batch([(row, self.table.item(row, 0).text(), data)])
+
+
+    def send_batch(self, rows):
+        '''
+        Send qty of all rows to PLC in one exchange, all R101
+        requests pipelined on one connection. Replies come back
+        in request order.
+        '''
+        if not rows:
+            return
+
+        logger.info(f'Sending {len(rows)} rows to PLC --- {dt.now()}')
+        messages = ['|'.join(['R101', order_no, qty]) for _, order_no, qty in rows]
+        request = PLCRequest(self.tcp_ip, self.tcp_port, messages, parent=self)
+        request.finished.connect(partial(self.get_batch_status, rows))
+        request.start()
+        for row, _, _ in rows:
+            self.set_col_text(row, 7, 'RUNNING')
             self.color_row(row, QColor(	235, 169, 158))
-            
-        except:
-            logging.error("Worker failed", exc_info=True)
+
+
+    def get_batch_status(self, rows, replies, connected):
+        self.toggle_tcp_conn(1 if connected else 0)
+        logger.info(f'Reply from TCP server: {replies}')
+        for i, (row, _, _) in enumerate(rows):
+            if i < len(replies):
+                self.get_plc_status((replies[i], row, 3))
+            else:
+                self.plc_send_failed(row)
+
+
+    def plc_send_failed(self, row):
+        logger.error(f"No reply from plc for row {row}")
+        self.set_col_text(row, 7, 'FAILED')
+        self.color_row(row, self.fail_color)
 
 
     def set_col_text(self, row, col, text):
@@ -462,10 +704,7 @@ class TableApp(QWidget):
             num_data = self.table.rowCount()
 
             if num_data > 0:
-                count = 0
-                for row in range(self.table.rowCount()):
-                    if self.table.item(row, 3).text() == 'OK':
-                        count += 1
+                count = self.reconciliation.infeed_count()
 
                 if count == num_data and not self.outfeed:
 
@@ -480,46 +719,77 @@ class TableApp(QWidget):
         msg_list = resp.split('|')
         if msg_list[0] == 'M101':
             logger.info(f"Reply from plc: {resp}")
+            self.worker.acknowledge(row)  # the link does not send R101 again
         elif msg_list[0] == 'M102':
             self.set_col_text(row, col, msg_list[1])
+            self.analytics.good(self.table.item(row, 0).text(), msg_list[1])
+            self.analytics_panel.refresh()
         elif msg_list[0] == 'M103':
             self.set_col_text(row, col, msg_list[1])
+            self.analytics.defect(self.table.item(row, 0).text(), msg_list[1])
+            self.analytics_panel.refresh()
         elif msg_list[0] == 'M104':
             self.set_col_text(row, col, msg_list[1])
             self.set_col_text(row, 7, "COMPLETED")
             self.color_row(row, QColor(	144, 238, 144))
+            self.analytics.completed(self.table.item(row, 0).text())
+            self.analytics_panel.refresh()
             row += 1  # go to next row
             self.worker.reassign(row, 3)  # change row and col for thread
 
 
-    def get_row_by_column_value(self, column, model) -> int:
-        for row in range(self.table.rowCount()):
-            item = self.table.item(row, column)
-            if item and item.text() == model:
-                return row, self.table.item(row, 2).text()
-
-
-    def check_row_exists(self, column, order):
-        for row in range(self.table.rowCount()):
-            item = self.table.item(row, column)
-            if item and item.text() == order:
-                return True
-
-        return False
-
-
     def check_outfeed(self, data : list):
         '''
         After infeed, rows are set
         At outfeed, check if scanned QR matches
-        by sending qty again to PLC
+        by sending qty again to PLC, once per kanban
         '''
-        try:
-            row_indx, qty = self.get_row_by_column_value(0, data[0])
+        order = data[2]
+        status = self.reconciliation.scan_outfeed(order)
+        if status == 'ok':
+            row_indx = self.reconciliation.row(order)
+            self.send_tcp(row_indx, self.table.item(row_indx, 3).text())
+        else:
+            logger.error(f"Outfeed {status} kanban: {order}")
+
+        self.update_outfeed_status()
+
+
+    def update_outfeed_status(self):
+        counts = self.reconciliation.counts()
+        text = (f"{counts['outfeed']}/{counts['infeed']} out, {counts['missing']} missing, "
+                f"{counts['extra']} extra, {counts['duplicates']} dup")
+        if counts['complete']:
+            self.outfeed = True
+            self.outfeed_field.setText(f"Lot complete: {text}")
+            self.outfeed_field.setStyleSheet("background-color: green;color:white")
+            logger.info(f"Lot reconciled: {self.reconciliation.report()}")
+        elif counts['extra'] or counts['duplicates']:
+            self.outfeed_field.setText(text)
+            self.outfeed_field.setStyleSheet("background-color: red;color:white")
+        else:
+            self.outfeed_field.setText(text)
+
+
+    def show_reconciliation(self):
+        '''
+        Missing/extra/duplicate kanbans of the lot
+        '''
+        report = self.reconciliation.report()
+        logger.info(f"Reconciliation report: {report}")
+
+        def listing(orders):
+            shown = ', '.join(list(orders)[:REPORT_LIMIT])
+            return shown + (f' ... (+{len(orders) - REPORT_LIMIT})' if len(orders) > REPORT_LIMIT else '')
 
-            self.send_tcp(row_indx, qty)
-        except TypeError as e:
-            logging.ERROR("Row is not present")
+        duplicates = {**report['infeed_duplicates'], **report['outfeed_duplicates']}
+        QMessageBox.information(self, 'Lot reconciliation', '\n\n'.join([
+            f"Lot {report['lot']}: {report['outfeed']}/{report['infeed']} kanbans out"
+            + (' - complete' if report['complete'] else ''),
+            f"Missing ({report['missing']}): {listing(report['missing_orders'])}",
+            f"Extra ({report['extra']}): {listing(report['extra_orders'])}",
+            f"Duplicates ({report['duplicates']}): {listing(sorted(duplicates))}",
+        ]))
 
 
     @Slot(list)
@@ -534,9 +804,8 @@ class TableApp(QWidget):
                 self.check_outfeed(data)
 
             elif COM==self.scanner_infeed and not self.infeed:
-                exists = self.check_row_exists(0, order)
-                if not exists:
-                    row_position = self.table.rowCount()
+                row_position = self.table.rowCount()
+                if self.reconciliation.scan_infeed(order, row_position):
                     self.table.insertRow(row_position)
                     self.table.setItem(row_position, 0, QTableWidgetItem(order))
                     self.table.setItem(row_position, 1, QTableWidgetItem(model))
@@ -547,6 +816,11 @@ class TableApp(QWidget):
                     self.table.setItem(row_position, 6, QTableWidgetItem('0'))  # completed   
                     self.table.setItem(row_position, 7, QTableWidgetItem('NEXT'))  # status
                     self.color_row(row_position, QColor(255, 200, 100))
+                    self.analytics.scan(order, model)
+                    self.analytics_panel.refresh()
+                else:
+                    logger.error(f"Infeed duplicate kanban: {order}")
+                    self.update_outfeed_status()
 
         else:
             self.name_field.clear()
@@ -563,17 +837,38 @@ class TableApp(QWidget):
     def save_table(self):
         _date = dt.today().strftime('%Y_%m_%d')
         dest_folders = os.path.join(os.getcwd(), _date)
+        lot = self.name_field.text()
         if self.table.rowCount() > 0:
-            data = []
-            data_header = ['Model', 'Packing code', 'Quantity']
-            for row in range(self.table.rowCount()):
-                data.append([self.table.item(row, 0).text(), self.table.item(row, 1).text(), self.table.item(row, 2).text()])
-
             scanner.create_dir(dest_folders)
-            scanner.create_excel(data, data_header, dest_folders, 'MRE_QR_kanban_info.xlsx')
 
-        if bool(self.name_field.text()):
-            scanner.save_to_disk(self.name_field.text(), dest_folders)
+            if 'xlsx' in self.export_formats:
+                data = []
+                data_header = ['Model', 'Packing code', 'Quantity']
+                for row in range(self.table.rowCount()):
+                    data.append([self.table.item(row, 0).text(), self.table.item(row, 1).text(), self.table.item(row, 2).text()])
+
+                scanner.create_excel(data, data_header, dest_folders, 'MRE_QR_kanban_info.xlsx')
+
+            if 'parquet' in self.export_formats:
+                # one row per kanban with the PLC counts, columns as in KANBAN_COLUMNS
+                names = [name for name, _ in scanner.KANBAN_COLUMNS[2:]]
+                today = dt.today().date()
+                data = []
+                for row in range(self.table.rowCount()):
+                    values = [self.table.item(row, col).text() for col in range(self.table.columnCount())]
+                    data.append(dict(zip(names, values), date=today, lot=lot))
+
+                scanner.create_parquet(data, scanner.KANBAN_COLUMNS, dest_folders, 'MRE_QR_kanban_info.parquet',
+                                       scanner.KANBAN_KEY)
+
+        if bool(lot):
+            scanner.save_to_disk(lot, dest_folders, self.export_formats, self.table.rowCount())
+
+
+    def check_shift(self):
+        if self.analytics.rollover():
+            logger.info(f'New shift from {self.analytics.shift}, analytics reset')
+            self.analytics_panel.refresh()
 
 
     def clear_table(self):
@@ -581,7 +876,10 @@ class TableApp(QWidget):
         self.name_field.clear()
         self.outfeed, self.infeed = False, False
         self.reset_style(self.infeed_field, 'IDLE')
+        self.reset_style(self.outfeed_field, '')
+        self.reconciliation = LotReconciliation()
         self.worker.stop()
+        self.worker.acked.clear()
         self.worker.reassign(0, 3)
 
 
@@ -0,0 +1,159 @@
+import time
+from collections import deque
+from datetime import datetime as dt, timedelta
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class RollingCounter:
+    '''
+    Event count over the last `window` seconds in one second
+    buckets. add() and total() are O(1) amortized, each
+    bucket is evicted exactly once.
+    '''
+
+    def __init__(self, window=3600):
+        self.window = window
+        self.buckets = deque()  # [second, count]
+        self.count = 0
+
+    def add(self, n=1, now=None):
+        second = int(time.monotonic() if now is None else now)
+        if self.buckets and self.buckets[-1][0] == second:
+            self.buckets[-1][1] += n
+        else:
+            self.buckets.append([second, n])
+        self.count += n
+        self.evict(second)
+
+    def evict(self, second):
+        while self.buckets and self.buckets[0][0] <= second - self.window:
+            self.count -= self.buckets.popleft()[1]
+
+    def total(self, now=None):
+        self.evict(int(time.monotonic() if now is None else now))
+        return self.count
+
+    def per_hour(self, now=None):
+        return self.total(now) * 3600 / self.window
+
+
+def parse_shifts(shifts):
+    # "HH:MM" shift start times -> sorted [(hour, minute)]
+    starts = []
+    for start in shifts:
+        hour, minute = start.split(':')
+        starts.append((int(hour), int(minute)))
+    return sorted(starts) or [(0, 0)]
+
+
+class ShiftAnalytics:
+    '''
+    Live shift figures updated per event, never by going
+    over the table or saved files:
+    - scan(): kanban scanned at infeed
+    - good()/defect(): M102/M103 counts from the PLC, these are
+      running totals per order so only the change is added
+    - completed(): M104, closes the order's cycle time
+    Rates and good/defect are over the rolling window, cycle
+    times over the shift. rollover() resets the figures when a
+    new shift starts (shifts are "HH:MM" start times), orders
+    still in process carry over into the new shift.
+    now is time.monotonic() seconds, wall a datetime.
+    '''
+
+    def __init__(self, window=3600, shifts=('00:00',)):
+        self.window = window
+        self.shifts = parse_shifts(shifts)
+        self.orders = {}  # order -> [model, start, good, defect]
+        self.reset()
+
+    def reset(self, wall=None):
+        '''
+        Start a new shift: counters and cycle times are cleared,
+        orders whose cycle is still open are kept
+        '''
+        self.shift = self.shift_start(wall)
+        self.scans = RollingCounter(self.window)
+        self.completions = RollingCounter(self.window)
+        self.totals = [RollingCounter(self.window), RollingCounter(self.window)]
+        self.orders = {order: entry for order, entry in self.orders.items() if entry[1] is not None}
+        self.models = {}  # model -> [good, defect] RollingCounters
+        for entry in self.orders.values():
+            self.models.setdefault(entry[0], [RollingCounter(self.window), RollingCounter(self.window)])
+        self.cycles = {}  # order -> seconds from infeed scan to M104, this shift
+        self.cycle_total = 0.0
+        self.last_cycle = None
+
+    def shift_start(self, wall=None):
+        wall = dt.now() if wall is None else wall
+        starts = [wall.replace(hour=hour, minute=minute, second=0, microsecond=0) for hour, minute in self.shifts]
+        past = [start for start in starts if start <= wall]
+        return max(past) if past else starts[-1] - timedelta(days=1)
+
+    def rollover(self, wall=None):
+        '''
+        Reset when a new shift has started, True if it did
+        '''
+        if self.shift_start(wall) == self.shift:
+            return False
+        self.reset(wall)
+        return True
+
+    def scan(self, order, model, now=None):
+        now = time.monotonic() if now is None else now
+        if order in self.orders:
+            return
+        self.orders[order] = [model, now, 0, 0]
+        self.models.setdefault(model, [RollingCounter(self.window), RollingCounter(self.window)])
+        self.scans.add(1, now)
+
+    def update_count(self, order, value, index, now=None):
+        entry = self.orders.get(order)
+        if entry is None:
+            return
+        value = to_int(value)
+        delta = value - entry[index]
+        entry[index] = value
+        if delta > 0:  # a lower value is the PLC resetting the count, nothing produced
+            self.models[entry[0]][index - 2].add(delta, now)
+            self.totals[index - 2].add(delta, now)
+
+    def good(self, order, value, now=None):
+        self.update_count(order, value, 2, now)
+
+    def defect(self, order, value, now=None):
+        self.update_count(order, value, 3, now)
+
+    def completed(self, order, now=None):
+        entry = self.orders.get(order)
+        if entry is None or entry[1] is None:
+            return
+        now = time.monotonic() if now is None else now
+        self.last_cycle = now - entry[1]
+        entry[1] = None  # cycle closed, later replies do not count twice
+        self.cycles[order] = self.last_cycle
+        self.cycle_total += self.last_cycle
+        self.completions.add(1, now)
+
+    def summary(self, now=None):
+        good, defect = (counter.total(now) for counter in self.totals)
+        models = {model: (g.total(now), d.total(now)) for model, (g, d) in self.models.items()}
+        return {
+            'shift_start': self.shift.isoformat(timespec='minutes'),
+            'kanbans_per_hour': self.completions.per_hour(now),
+            'scans_per_hour': self.scans.per_hour(now),
+            'good': good,
+            'defect': defect,
+            'defect_rate': defect / (good + defect) if good + defect else 0.0,
+            'avg_cycle': self.cycle_total / len(self.cycles) if self.cycles else None,
+            'last_cycle': self.last_cycle,
+            'cycles': dict(self.cycles),
+            'models': {model: {'good': g, 'defect': d, 'defect_rate': d / (g + d) if g + d else 0.0}
+                       for model, (g, d) in models.items()},
+        }
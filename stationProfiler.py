@@ -0,0 +1,137 @@
+import os
+import io
+import sys
+import json
+import time
+import cProfile
+import pstats
+import logging
+import threading
+from collections import Counter
+from threading import Thread, Lock
+from datetime import datetime as dt
+
+
+logger = logging.getLogger(__name__)
+
+
+def fold_stack(frame):
+    # outermost first, function:file:line joined by ';'
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f'{code.co_name}:{os.path.basename(code.co_filename)}:{frame.f_lineno}')
+        frame = frame.f_back
+    return ';'.join(reversed(parts))
+
+
+class RuntimeProfiler:
+    '''
+    Profile a running station without restarting it.
+
+    sample() takes stack snapshots of every thread for a while,
+    profile_begin()/profile_end() run cProfile on the calling
+    thread. Results go to <output>/<YYYY_MM_DD>/<name>_<HHMMSS>_*
+    '''
+
+    def __init__(self, name, enabled=False, duration=30, interval=0.005, output='profiles'):
+        self.name = name
+        self.enabled = enabled
+        self.duration = duration
+        self.interval = interval
+        self.output = output
+        self.lock = Lock()
+        self.sampling = False
+        self.profile = None
+
+    @classmethod
+    def from_config(cls, name, config):
+        return cls(name, **config.get('PROFILING', {}))
+
+    def target(self, suffix):
+        dest_folders = os.path.join(os.getcwd(), self.output, dt.today().strftime('%Y_%m_%d'))
+        os.makedirs(dest_folders, exist_ok=True)
+        return os.path.join(dest_folders, f"{self.name}_{dt.now().strftime('%H%M%S')}_{suffix}")
+
+    def sample(self, duration=None, threads=()):
+        '''
+        Start sampling all threads in the background. threads are
+        workers exposing cpu_time (time.thread_time() updated from
+        their own loop), their CPU use over the window is recorded
+        '''
+        with self.lock:
+            if self.sampling:
+                logger.info('Profiler already sampling')
+                return False
+            self.sampling = True
+
+        t = Thread(target=self._sample, args=(duration or self.duration, list(threads)))
+        t.daemon = True
+        t.start()
+        return True
+
+    def _sample(self, duration, threads):
+        logger.info(f'Sampling {self.name} for {duration}s')
+        stacks = Counter()
+        cpu_start = {id(t): getattr(t, 'cpu_time', 0.0) for t in threads}
+        me = sys._getframe().f_code
+        samples = 0
+        start = time.perf_counter()
+        try:
+            while time.perf_counter() - start < duration:
+                for ident, frame in sys._current_frames().items():
+                    if frame.f_code is me:
+                        continue
+                    stacks[(ident, fold_stack(frame))] += 1
+                samples += 1
+                time.sleep(self.interval)
+
+            elapsed = time.perf_counter() - start
+            names = {t.ident: t.name for t in threading.enumerate()}
+
+            # folded stacks, one line per unique stack: thread;frames count
+            with open(self.target('stacks.txt'), 'w', encoding='utf-8') as f:
+                for (ident, stack), count in stacks.most_common():
+                    f.write(f'{names.get(ident, ident)};{stack} {count}\n')
+
+            cpu = {}
+            for t in threads:
+                used = getattr(t, 'cpu_time', 0.0) - cpu_start[id(t)]
+                cpu[getattr(t, 'name', type(t).__name__)] = {
+                    'cpu_seconds': used,
+                    'utilization': used / elapsed,
+                }
+            with open(self.target('threads.json'), 'w', encoding='utf-8') as f:
+                json.dump({'seconds': elapsed, 'samples': samples, 'threads': cpu}, f, indent=2)
+
+            logger.info(f'Sampling {self.name} done, {samples} samples')
+        except Exception:
+            logger.error('Sampling failed', exc_info=True)
+        finally:
+            with self.lock:
+                self.sampling = False
+
+    def profile_begin(self):
+        '''
+        cProfile the calling thread until profile_end()
+        is called from that same thread
+        '''
+        if self.profile is not None:
+            return False
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return True
+
+    def profile_end(self):
+        if self.profile is None:
+            return
+        self.profile.disable()
+        profile, self.profile = self.profile, None
+        try:
+            profile.dump_stats(self.target('cprofile.prof'))
+            out = io.StringIO()
+            pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(40)
+            with open(self.target('cprofile.txt'), 'w', encoding='utf-8') as f:
+                f.write(out.getvalue())
+        except Exception:
+            logger.error('Writing profile failed', exc_info=True)
@@ -0,0 +1,120 @@
+import json
+import zlib
+import logging
+import threading
+from threading import Thread
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+logger = logging.getLogger(__name__)
+
+MAX_WAIT = 60  # seconds a long-poll may hold a request
+
+
+class Snapshot:
+    '''
+    Station status as served, never modified once published
+    '''
+    __slots__ = ('version', 'etag', 'body')
+
+    def __init__(self, version, body):
+        self.version = version
+        self.etag = f'"{version}-{zlib.crc32(body):08x}"'
+        self.body = body
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    '''
+    GET /status returns the current snapshot as JSON with an ETag.
+    With If-None-Match it answers 304 when nothing changed, adding
+    ?wait=<seconds> holds the request until the next change instead.
+    '''
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/status':
+            self.send_error(404)
+            return
+
+        etag = self.headers.get('If-None-Match')
+        snapshot = self.server.status.snapshot
+        if etag == snapshot.etag:
+            try:
+                wait = min(float(parse_qs(url.query).get('wait', ['0'])[0]), MAX_WAIT)
+            except ValueError:
+                wait = 0
+            if wait > 0:
+                snapshot = self.server.status.wait_change(etag, wait)
+
+        if etag == snapshot.etag:
+            self.send_response(304)
+            self.send_header('ETag', snapshot.etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(snapshot.body)))
+        self.send_header('ETag', snapshot.etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(snapshot.body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class StatusServer:
+    '''
+    Read-only local status API for MES/SCADA polling. The station
+    publishes a new snapshot when its state changes, requests
+    only read the current one so pollers never touch the gui.
+    '''
+
+    def __init__(self, host='127.0.0.1', port=8765):
+        self.cond = threading.Condition()
+        self.snapshot = Snapshot(0, b'{}')
+        self.httpd = ThreadingHTTPServer((host, port), StatusHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.status = self
+
+    @classmethod
+    def from_config(cls, config):
+        conf = config.get('STATUS_API', {})
+        if not conf.get('enabled'):
+            return None
+        return cls(conf.get('host', '127.0.0.1'), conf.get('port', 8765))
+
+    def start(self):
+        t = Thread(target=self.httpd.serve_forever)
+        t.daemon = True
+        t.start()
+        logger.info(f'Status API on {self.httpd.server_address}')
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        with self.cond:
+            self.cond.notify_all()
+
+    def publish(self, state, rows=None):
+        '''
+        Swap in a snapshot of state (JSON serialisable), no-op when
+        nothing changed so ETags stay valid. rows are pre-encoded
+        JSON objects served as state['rows'], so callers can keep
+        unchanged rows encoded between publishes
+        '''
+        body = json.dumps(state, sort_keys=True).encode('utf-8')
+        if rows is not None:
+            body = b''.join([body[:-1], b', "rows": [' if state else b'"rows": [', b', '.join(rows), b']}'])
+        if body == self.snapshot.body:
+            return
+        with self.cond:
+            self.snapshot = Snapshot(self.snapshot.version + 1, body)
+            self.cond.notify_all()
+
+    def wait_change(self, etag, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: self.snapshot.etag != etag, timeout)
+            return self.snapshot